@@ -43,11 +43,15 @@ import dataframe_image as dfi #pip install dataframe_image
 new_directory_path = "/Users/emilyquick-cole/Documents/Python/medicare_analysis"
 os.chdir(new_directory_path)
 
-#Load your dataset (e.g., CSV file)
-df = pd.read_csv('Medicare_Hospital_Spending_Per_Patient-Hospital.csv')
+# Set MSPB_DEBUG=1 (or true/yes) in the environment to also export the intermediate dataframes to Excel for review
+DEBUG_EXPORT = os.environ.get("MSPB_DEBUG", "").strip().lower() in ("1", "true", "yes")
 
-#Save as a dataframe
-df = pd.DataFrame(df)
+#Load your dataset (e.g., CSV file), keeping only the columns used in the analysis and review exports
+#Facility ID is read as a string to keep its leading zeros, State as a categorical variable since there are only ~50
+#distinct states across thousands of hospitals, and Score as a string since some rows are 'Not Available'
+df = pd.read_csv('Medicare_Hospital_Spending_Per_Patient-Hospital.csv',
+                 usecols=['Facility ID', 'Facility Name', 'City/Town', 'State', 'Score'],
+                 dtype={'Facility ID': str, 'State': 'category', 'Score': str})
 
 #Count the number of rows within the dataset--this is the number of hospitals
 total_hospitals = len(df)
@@ -57,38 +61,39 @@ print(f"There are {total_hospitals} hospitals in this dataset.")
 rows_with_missing_data = df['Score'].isnull().sum() #No rows are missing data; however, some rows have N/A indicated
 print(f"Number of rows with missing data: {rows_with_missing_data}")
 
+# Flag rows where the Score column is indicated as "Not Available" once and reuse the mask below
+is_na = df['Score'].eq('Not Available')
+
 # Count rows where the Score column is indicated as "Not Available"
-na_count = (df['Score'] == 'Not Available').sum()
+na_count = int(is_na.sum())
 print(f"{na_count} hospitals reported that scores were not available") #1,682 rows are indicated as Not Available
 
 #Save not available scores to a new data frame and drop them from original dataframe
-na_df = df[df['Score'] == 'Not Available']
-print('na_df score col', na_df['Score'])
+na_df = df.loc[is_na].copy()
 
 #Remove rows that contain a Score value of 'Not Available'
-score_df = df[df['Score'] != 'Not Available']
+score_df = df.loc[~is_na].copy()
 
 #Check that the only values remaining can be converted to a float
 print('Unique values of score are', df['Score'].unique())
 
 #set Score variable to a float
-score_df['Score'] = score_df['Score'].astype('float64')
-
-#Set the State column to a string
-score_df['State'] = score_df['State'].astype('string')
+score_df['Score'] = pd.to_numeric(score_df['Score'])
 
 '''Formatting Data for Map Visual '''
 #Group hospitals by state and take their median Score and reset the index of the resulting dataframe
-med_df = score_df.groupby(['State'])['Score'].median().reset_index()
+#No need to sort the groups here since the result is sorted by Score below
+med_df = score_df.groupby('State', observed=True, sort=False)['Score'].median().reset_index()
 
 #sort the data from greatest to least
 med_df = med_df.sort_values(by=['Score'], ascending=False)
-print(f"The median Medicare Spending per Beneficiary Score (MSPB) by state is {med_df}.")
+print(f"The median Medicare Spending per Beneficiary Score (MSPB) was calculated for {len(med_df)} states.")
 
 #print the number of states with a score of 1.0, above 1.0, and below 1.0
-above1 = len(med_df[med_df['Score'] > 1.0])
-at1 = len(med_df[med_df['Score'] == 1.0])
-below1 = len(med_df[med_df['Score'] < 1.0])
+state_scores = med_df['Score'].to_numpy()
+above1 = int((state_scores > 1.0).sum())
+at1 = int((state_scores == 1.0).sum())
+below1 = int((state_scores < 1.0).sum())
 print(f"{above1} states have a median score over 1.0. {at1} states have a median score of 1.0. {below1} states have a median score less than 1.0.")
 
 
@@ -100,38 +105,17 @@ gdf = gpd.read_file('/Users/emilyquick-cole/Documents/Python/medicare_analysis/c
 gdf = gdf.merge(med_df,left_on='STUSPS',right_on='State')
 
 #Check that the dataframes merged correctly
-gdf.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/gdf.xlsx', index=False)
-
-#We can re-project coordinates for any of the components of our map using the geopandas command .to_crs()
-gdf.to_crs({'init':'epsg:2163'})
-
-#Create new boxes to map them in underneath and to the left of the continental US.
-#Create a "copy" of gdf for re-projecting
-visframe = gdf.to_crs({'init':'epsg:2163'})
-
-#Create figure and axes for with Matplotlib for main map
-fig, ax = plt.subplots(1, figsize=(18, 14))
-
-#Remove the axis box from the main map
-ax.axis('off')
-
-#Create map of all states except AK and HI in the main map axis
-visframe[~visframe.STUSPS.isin(['HI','AK'])].plot(color='lightblue', linewidth=0.8, ax=ax, edgecolor='0.8')
-
-#Add Alaska Axis (x, y, width, height)
-akax = fig.add_axes([0.1, 0.17, 0.17, 0.16])
-
-#Add Hawaii Axis(x, y, width, height)
-hiax = fig.add_axes([.28, 0.20, 0.1, 0.1])
-
-#We'll later map Alaska in "akax" and Hawaii in "hiax"
+if DEBUG_EXPORT:
+    gdf.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/gdf.xlsx', index=False)
 
 #Apply this to the gdf to ensure all states are assigned colors by the same func
 def makeColorColumn(gdf,variable,vmin,vmax):
-    # apply a function to a column to create a new column of assigned colors & return full frame
+    # map the whole column to colors at once to create a new column of assigned colors & return full frame
     norm = mcolors.Normalize(vmin=vmin, vmax=vmax, clip=True)
     mapper = plt.cm.ScalarMappable(norm=norm, cmap=plt.cm.YlOrBr)
-    gdf['value_determined_color'] = gdf[variable].apply(lambda x: mcolors.to_hex(mapper.to_rgba(x)))
+    # keep the colors as RGBA tuples, which matplotlib takes directly without parsing hex strings
+    rgba = mapper.to_rgba(gdf[variable].to_numpy())
+    gdf['value_determined_color'] = list(map(tuple, rgba))
     return gdf
 
 #S the value column that will be visualised
@@ -145,8 +129,23 @@ vmin, vmax = gdf.Score.min(), gdf.Score.max() #math.ceil(gdf.pct_food_insecure.m
 colormap = "YlOrBr" #yellow brown color scale
 gdf = makeColorColumn(gdf,variable,vmin,vmax)
 
-#Create "visframe" as a re-projected gdf using EPSG 2163 for CONUS
-visframe = gdf.to_crs({'init':'epsg:2163'})
+#We can re-project coordinates for any of the components of our map using the geopandas command .to_crs()
+#Create "visframe" as a re-projected gdf using EPSG 2163 for CONUS, after the colors are assigned so it keeps them
+visframe = gdf.to_crs(epsg=2163)
+
+#Index both frames by state abbreviation so the state lookups below are index lookups rather than full-column scans
+#States with no scored hospitals are missing from both frames, so the lookups below skip absent states instead of raising
+gdf_by_state = gdf.set_index('STUSPS', drop=False)
+visframe_by_state = visframe.set_index('STUSPS', drop=False)
+
+#Clip Alaska and Hawaii once up front; the clipped frames keep their value_determined_color column for plotting
+#Polygon to clip Alaska's western islands
+polygon = Polygon([(-170,50),(-170,72),(-140, 72),(-140,50)])
+ak_clipped = gpd.clip(gdf_by_state.loc[gdf_by_state.index.intersection(['AK'])], polygon)
+
+#Polygon to clip Hawaii's western islands
+hipolygon = Polygon([(-160,0),(-160,90),(-120,90),(-120,0)])
+hi_clipped = gpd.clip(gdf_by_state.loc[gdf_by_state.index.intersection(['HI'])], hipolygon)
 
 #Create figure and axes for Matplotlib
 fig, ax = plt.subplots(1, figsize=(18, 14))
@@ -184,35 +183,28 @@ ax.annotate("Data: CMS Medicare Spending Per Beneficiary - Hospital, accessed 2
             xy=(0.22, .085), xycoords='figure fraction', fontsize= 14, color='#555555')
 
 # create map
-# Note: we're going state by state here because of unusual coloring behavior when trying to plot the entire dataframe using the "value_determined_color" column
-for row in visframe.itertuples():
-    if row.State not in ['AK','HI']:
-        vf = visframe[visframe.State==row.State]
-        c = gdf[gdf.State==row.State][0:1].value_determined_color.item()
-        vf.plot(color=c, linewidth=0.8, ax=ax, edgecolor='0.8')
+# Plot all continental states in one call, passing the colors as a list aligned with the filtered rows
+conus = visframe_by_state.drop(['HI','AK'], errors='ignore')
+conus.plot(color=conus['value_determined_color'].tolist(), linewidth=0.8, ax=ax, edgecolor='0.8')
 
 #Add Alaska
 akax = fig.add_axes([0.1, 0.17, 0.2, 0.19])
 akax.axis('off')
-#Polygon to clip western islands
-polygon = Polygon([(-170,50),(-170,72),(-140, 72),(-140,50)])
-alaska_gdf = gdf[gdf.State=='AK']
-alaska_gdf.clip(polygon).plot(color=gdf[gdf.State=='AK'].value_determined_color, linewidth=0.8,ax=akax, edgecolor='0.8')
+ak_clipped.plot(color=ak_clipped['value_determined_color'].tolist(), linewidth=0.8,ax=akax, edgecolor='0.8')
 
 #Add Hawaii
 hiax = fig.add_axes([.28, 0.20, 0.1, 0.1])
 hiax.axis('off')
-
-#Polygon to clip western islands
-hipolygon = Polygon([(-160,0),(-160,90),(-120,90),(-120,0)])
-hawaii_gdf = gdf[gdf.State=='HI']
-hawaii_gdf.clip(hipolygon).plot(column=variable, color=hawaii_gdf['value_determined_color'], linewidth=0.8,ax=hiax, edgecolor='0.8')
+hi_clipped.plot(color=hi_clipped['value_determined_color'].tolist(), linewidth=0.8,ax=hiax, edgecolor='0.8')
 
 # bbox_inches="tight" keeps the vis from getting cut off at the edges in the saved png
 # dip is "dots per inch" and controls image quality.  Many scientific journals have specifications for this
 # https://stackoverflow.com/questions/16183462/saving-images-in-python-at-a-very-high-quality
 fig.savefig(os.getcwd()+'/MSPBmap.png',dpi=400, bbox_inches="tight")
 
+#Close the figure now that it is saved to release it from matplotlib
+plt.close(fig)
+
 
 '''Regional Table: generate a table grouping states by region, finding median MSPB score and total hospitals from which
 median is based on'''
@@ -224,90 +216,59 @@ southwest = ['OK', 'TX', 'AZ', 'NM']
 west = ['CO', 'WY', 'MT', 'UT', 'ID', 'WA', 'OR', 'NV', 'CA', 'AK', 'HI']
 south = ['VA', 'WV', 'KY', 'NC', 'TN', 'AR', 'SC', 'GA', 'AL', 'MS', 'LA', 'FL']
 
-#Create new Region column
-score_df.insert(loc = 6, column = 'Region', value = np.nan)
-
-#Iterate through the data and assign a region to each row based on the state a hospital is located in
-score_df = score_df.reset_index()  # make sure indexes pair with number of rows
-
-#Create a function to
-def categorize_region(value):
-    if value in ne:
-        return 'North East'
-    elif value in midatl:
-        return 'Mid-Atlantic'
-    elif value in midwest:
-        return 'Midwest'
-    elif value in southwest:
-        return 'South West'
-    elif value in west:
-        return 'West'
-    elif value in south:
-        return 'South'
-
-#Apply the function to assign Region categories
-score_df['Region'] = score_df['State'].apply(categorize_region)
+#Build a lookup of state to region once so each row is a single dictionary lookup
+state_to_region = ({s: 'North East' for s in ne} | {s: 'Mid-Atlantic' for s in midatl} | {s: 'Midwest' for s in midwest}
+                   | {s: 'South West' for s in southwest} | {s: 'West' for s in west} | {s: 'South' for s in south})
+
+#Create a new Region column by mapping each state to its Region category and set it as a categorical variable
+#Because State is categorical, .map only looks up each distinct state once and then reuses the category codes for every row
+score_df['Region'] = score_df['State'].map(state_to_region).astype('category')
 
 # Export to an Excel document to review the data
-score_df.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/score_df.xlsx', index=False)
+if DEBUG_EXPORT:
+    score_df.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/score_df.xlsx', index=False)
 
 '''Formatting Data for Regional Table: group hospitals by state and take their median Score and reset the index of 
 the resulting dataframe'''
 
-#Set the region as a categorical variable
-score_df['Region'] = score_df['Region'].astype('category')
-
-#take median of score by region
-regional_df = score_df.groupby(['Region'])['Score'].median().reset_index(drop= False)
+#take median of score by region, keeping Region as the index so the tables below line up on it
+regional_df = score_df.groupby('Region', observed=True)['Score'].median().rename('Median Score')
 
 #Count the number of hospitals with recorded scores for each region
-reg_hosp_df = score_df['Region'].value_counts()
+reg_hosp_df = score_df['Region'].value_counts().rename('Hospitals w/ Scores')
 
 #Count the number of hospitals with no recorded scores ("not available") for each region
-na_df['Region'] = na_df['State'].apply(categorize_region)
-print("na_df is", na_df)
+na_df['Region'] = na_df['State'].map(state_to_region).astype('category')
+na_in_region = int(na_df['Region'].notna().sum())
+print(f"{na_in_region} hospitals without scores were assigned a region; "
+      f"{len(na_df) - na_in_region} are in territories outside the regional categories")
 
 # Export to an Excel document to review the data
-na_df.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/na_df.xlsx', index=False)
-na_hosp_df = na_df['Region'].value_counts()
+if DEBUG_EXPORT:
+    na_df.to_excel('/Users/emilyquick-cole/Documents/Python/medicare_analysis/na_df.xlsx', index=False)
+na_hosp_df = na_df['Region'].value_counts().rename('Hospitals w/o Scores')
 print("na_hosp_df is", na_hosp_df)
 
-#Merge the dataframes on Region
-#First merge the dataframe with median Score values and hospitals that reported
-table_df = regional_df.merge(reg_hosp_df,left_on='Region',right_on='Region')
-
-#Then merge that dataframe with the counts of hospitals that had "Not Available" reported
-table_df = table_df.merge(na_hosp_df,left_on='Region',right_on='Region')
+#Join the median Score values, hospitals that reported, and hospitals that had "Not Available" reported on their shared Region index
+table_df = pd.concat([regional_df, reg_hosp_df, na_hosp_df], axis=1, join='inner').rename_axis('Region').reset_index()
 
 #Create a new column that totals the number of hospitals with reported scores and hospitals with "not available" scores
-table_df['Total Hospitals'] = table_df['count_x'] + table_df['count_y']
-
-#Reorganize the table so that the order is Region, Total Count, Hospitals w/ Scores Count, Hospitals w/o Scores Count, Median Score
-table_df = table_df.iloc[:, [0, 4, 3, 2, 1]]  # 'Region', 'Score', 'count' is original order
+table_df['Total Hospitals'] = table_df['Hospitals w/ Scores'] + table_df['Hospitals w/o Scores']
 
-#Rename column headers
-table_df = table_df.rename(columns={'Score': 'Median Score', 'count_x': 'Hospitals w/ Scores', 'count_y': 'Hospitals w/o Scores'})
+#Reorganize the table so that the order is Region, Total Count, Hospitals w/o Scores Count, Hospitals w/ Scores Count, Median Score
+table_df = table_df[['Region', 'Total Hospitals', 'Hospitals w/o Scores', 'Hospitals w/ Scores', 'Median Score']]
 
-#Sort the data frame from lowest to highest regional median score
-table_df = table_df.sort_values('Median Score')
+#Sort the data frame from lowest to highest regional median score, breaking ties alphabetically by Region
+table_df = table_df.sort_values(['Median Score', 'Region'], kind='stable')
 
 # Make a list of columns we'd like to sum for a "Totals" row
 cols_to_sum = ['Total Hospitals', 'Hospitals w/o Scores', 'Hospitals w/ Scores']
 
-#Add a totals row
-totals = table_df[cols_to_sum].sum(numeric_only=True)
+#Build a one-row totals dataframe with a 'Total' label at the end of the list of regions
+totals_row = pd.DataFrame({'Region': ['Total'], **{col: [table_df[col].sum()] for col in cols_to_sum}, 'Median Score': [np.nan]})
 
-# Create a new name for the row
-total_row = pd.Series(totals, name='Total')
-
-#Add a 'Total' label at the end of the list of regions
-total_row['Region'] = 'Total'
-
-#Review what the table looks like
-print("merged table", table_df)
-
-# Append the totals row to the DataFrame
-table_df.loc['Total'] = total_row
+# Append the totals row to the DataFrame with a fresh 0..n index
+table_df = pd.concat([table_df, totals_row], ignore_index=True)
 
 
 '''Generate Regional Data Table'''
@@ -336,9 +297,6 @@ def bold_row(row):
     else:
         return [''] * len(row)
 
-#Reset the index
-table_df.reset_index(inplace=True, drop=True)
-
 #Apply styling to the table_df dataframe.
 #Hide the index for final output, align the text, format the median score to only include 2 decimal points
 #set the background gradient to align with the map output figure and add a caption